@@ -1,16 +1,231 @@
+import time
+
+# Istante di inizio dell'esecuzione dello script, usato per misurare avvio a freddo e rerun
+_inizio_esecuzione = time.perf_counter()
+
 import streamlit as st
-import pandas as pd
-import requests
-import numpy as np
 from datetime import datetime
-import itertools
 import os
-import time
+import io
+import json
+import hashlib
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 st.set_page_config(page_title="Calcolatore Tragitto Multi-Tappa", layout="wide")
 
 st.title("Calcolatore del Tragitto Minimo tra Casa e Lavori")
 
+# Database SQLite condiviso tra tutte le sessioni: coda dei job e cache delle chiamate API
+JOBS_DB_PATH = os.environ.get(
+    "TRAGITTO_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "tragitto_jobs.db")
+)
+# Numero di worker in background (basso per rispettare i limiti di Nominatim e OSRM)
+JOB_WORKERS = int(os.environ.get("TRAGITTO_JOB_WORKERS", "2"))
+# Intervallo in secondi tra due aggiornamenti dell'avanzamento di un job
+JOB_POLL_SECONDS = 2
+# Un job in corso senza avanzamenti da più di questi secondi è considerato bloccato e non viene riusato
+JOB_STALE_SECONDS = 900
+# Tempo massimo di attesa per una risposta di Nominatim o OSRM
+HTTP_TIMEOUT_SECONDS = 20
+# Versione del calcolo dei giorni: cambiandola i risultati salvati in risultati_giorni non vengono più riusati
+VERSIONE_CALCOLO = 2
+# Valore usato nella matrice per le tratte che OSRM non ha potuto calcolare
+VALORE_NON_DISPONIBILE = 9999
+# Numero massimo di lavori per cui il confronto prova tutte le permutazioni
+MAX_LAVORI_PERMUTAZIONI = 8
+# Profilo orario dei fattori di durata (ORA;FATTORE): moltiplica le durate statiche di OSRM in base all'ora
+PROFILO_ORARIO_PATH = os.environ.get(
+    "TRAGITTO_PROFILO_ORARIO_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "profilo_orario.csv")
+)
+# Orario di partenza da casa proposto per il calcolo dei tempi
+ORARIO_PARTENZA_DEFAULT = "08:00"
+
+# File in cui vengono registrati i tempi del primo run dello script (per processo e per sessione)
+STARTUP_METRICS_PATH = os.environ.get(
+    "TRAGITTO_STARTUP_METRICS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_metrics.csv")
+)
+# Dimensione oltre la quale il file delle metriche viene ruotato (viene conservata una sola copia precedente)
+STARTUP_METRICS_MAX_BYTES = 1_000_000
+
+# Moduli pesanti: vengono importati solo quando servono, cioè dopo il caricamento di un CSV
+pd = None
+np = None
+requests = None
+itertools = None
+_heavy_modules_lock = threading.Lock()
+
+# Funzione per importare i moduli pesanti al primo utilizzo
+# (sicura tra thread: i worker e lo script possono chiamarla insieme all'avvio)
+def load_heavy_modules():
+    global pd, np, requests, itertools
+    # itertools è l'ultimo modulo assegnato: se è presente lo sono anche gli altri
+    if itertools is not None:
+        return
+    with _heavy_modules_lock:
+        if itertools is None:
+            import pandas as pd
+            import numpy as np
+            import requests
+            import itertools
+
+# Metriche condivise dal processo. Il tempo parte dall'inizio dello script, quindi il primo run misura
+# il primo run dello script dopo l'avvio del server, non l'avvio del container
+@st.cache_resource
+def get_startup_metrics():
+    return {"primo_run_processo_ms": None, "ultimo_run_ms": None}
+
+# Funzione per registrare la durata di un run dello script
+# Nel file finiscono solo il primo run del processo e il primo run di ogni sessione
+def record_startup_time(durata_ms, file_caricato):
+    metrics = get_startup_metrics()
+    metrics["ultimo_run_ms"] = durata_ms
+    
+    if metrics["primo_run_processo_ms"] is None:
+        metrics["primo_run_processo_ms"] = durata_ms
+        tipo = "primo_run_processo"
+    elif not st.session_state.get("primo_run_registrato"):
+        tipo = "primo_run_sessione"
+    else:
+        return metrics
+    st.session_state.primo_run_registrato = True
+    
+    try:
+        if os.path.exists(STARTUP_METRICS_PATH) and os.path.getsize(STARTUP_METRICS_PATH) > STARTUP_METRICS_MAX_BYTES:
+            os.replace(STARTUP_METRICS_PATH, STARTUP_METRICS_PATH + ".1")
+        nuovo_file = not os.path.exists(STARTUP_METRICS_PATH)
+        with open(STARTUP_METRICS_PATH, "a", encoding="utf-8") as f:
+            if nuovo_file:
+                f.write("TIMESTAMP;TIPO;DURATA_MS;FILE_CARICATO\n")
+            f.write(f"{datetime.now().isoformat(timespec='seconds')};{tipo};{durata_ms:.1f};{int(file_caricato)}\n")
+    except OSError:
+        pass
+    
+    return metrics
+
+# I rerun automatici per l'avanzamento dei job non vengono registrati: falserebbero la latenza dei rerun
+rerun_da_polling = st.session_state.pop("rerun_da_polling", False)
+
+# Funzione per registrare la durata del run corrente (una volta per run, anche se termina in anticipo)
+def finish_run():
+    if rerun_da_polling:
+        return get_startup_metrics()
+    return record_startup_time((time.perf_counter() - _inizio_esecuzione) * 1000, bool(uploaded_file))
+
+# Funzione per interrompere il run registrandone la durata
+def stop_run():
+    finish_run()
+    st.stop()
+
+# Funzione per rieseguire lo script registrando la durata del run corrente
+def restart_run():
+    finish_run()
+    st.experimental_rerun()
+
+# Crea lo schema del database una sola volta per processo e restituisce il percorso usato
+# Se la cartella dell'applicazione non è scrivibile usa la cartella temporanea; None se nessuna delle due funziona
+@st.cache_resource
+def init_db():
+    for path in (JOBS_DB_PATH, os.path.join(tempfile.gettempdir(), "tragitto_jobs.db")):
+        try:
+            conn = sqlite3.connect(path, timeout=30)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript("""
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        csv_hash TEXT NOT NULL,
+                        dati TEXT NOT NULL,
+                        parametri TEXT NOT NULL,
+                        stato TEXT NOT NULL,
+                        giorni_totali INTEGER NOT NULL,
+                        errore TEXT,
+                        creato REAL NOT NULL,
+                        aggiornato REAL NOT NULL
+                    );
+                    CREATE TABLE IF NOT EXISTS job_giorni (
+                        job_id INTEGER NOT NULL,
+                        posizione INTEGER NOT NULL,
+                        giorno TEXT NOT NULL,
+                        risultato TEXT,
+                        problemi TEXT NOT NULL,
+                        riutilizzato INTEGER NOT NULL DEFAULT 0,
+                        avvisi TEXT NOT NULL DEFAULT '[]',
+                        PRIMARY KEY (job_id, posizione)
+                    );
+                    CREATE TABLE IF NOT EXISTS risultati_giorni (
+                        hash TEXT PRIMARY KEY,
+                        risultato TEXT NOT NULL,
+                        aggiornato REAL NOT NULL
+                    );
+                    CREATE TABLE IF NOT EXISTS cache_geocodifica (
+                        indirizzo TEXT PRIMARY KEY,
+                        lat REAL NOT NULL,
+                        lon REAL NOT NULL,
+                        nome TEXT
+                    );
+                    CREATE TABLE IF NOT EXISTS cache_percorsi (
+                        chiave TEXT PRIMARY KEY,
+                        distanza REAL NOT NULL,
+                        durata REAL NOT NULL
+                    );
+                """)
+            finally:
+                conn.close()
+            return path
+        except sqlite3.Error:
+            continue
+    return None
+
+# Funzione per aprire una connessione al database dei job (lo schema è creato da init_db)
+def get_db_connection():
+    if db_path is None:
+        raise sqlite3.OperationalError("Database dei job non disponibile")
+    return sqlite3.connect(db_path, timeout=30)
+
+# Funzione per leggere un valore dalla cache condivisa (None se assente o se il database non è disponibile)
+# Se viene passata una connessione la riusa, altrimenti ne apre una solo per questa lettura
+def read_cache(query, params, conn=None):
+    own_conn = conn is None
+    try:
+        if own_conn:
+            conn = get_db_connection()
+        try:
+            return conn.execute(query, params).fetchone()
+        finally:
+            if own_conn:
+                conn.close()
+    except sqlite3.Error:
+        return None
+
+# Funzione per scrivere un valore nella cache condivisa (gli errori non bloccano il calcolo)
+def write_cache(query, params, conn=None):
+    own_conn = conn is None
+    try:
+        if own_conn:
+            conn = get_db_connection()
+        try:
+            with conn:
+                conn.execute(query, params)
+        finally:
+            if own_conn:
+                conn.close()
+    except sqlite3.Error:
+        pass
+
+# Funzione per segnalare un avviso: nella UI lo mostra con Streamlit, nei worker in background
+# (che non hanno un contesto Streamlit) lo aggiunge alla lista avvisi salvata con il job
+def notify(messaggio, avvisi=None, mostra=None):
+    if avvisi is not None:
+        avvisi.append(messaggio)
+    else:
+        (mostra or st.warning)(messaggio)
+
 # Funzione per caricare il file CSV
 def load_csv(uploaded_file):
     if uploaded_file is not None:
@@ -31,7 +246,12 @@ def load_csv(uploaded_file):
     return None
 
 # Funzione per geocodificare un indirizzo usando OpenStreetMap Nominatim API
-def geocode_address(address):
+def geocode_address(address, conn=None, avvisi=None):
+    # Usa la cache condivisa tra sessioni e worker per non ripetere le richieste a Nominatim
+    cached = read_cache("SELECT lat, lon, nome FROM cache_geocodifica WHERE indirizzo = ?", (address,), conn)
+    if cached is not None:
+        return cached[0], cached[1], cached[2]
+    
     try:
         base_url = "https://nominatim.openstreetmap.org/search"
         params = {
@@ -43,17 +263,23 @@ def geocode_address(address):
             "User-Agent": "TragittoCalculator/1.0"  # Necessario per le regole di Nominatim
         }
         
-        response = requests.get(base_url, params=params, headers=headers)
+        response = requests.get(base_url, params=params, headers=headers, timeout=HTTP_TIMEOUT_SECONDS)
         data = response.json()
         
         if data and len(data) > 0:
             lat = float(data[0]["lat"])
             lon = float(data[0]["lon"])
-            return lat, lon, data[0]["display_name"] if "display_name" in data[0] else None
+            full_address = data[0]["display_name"] if "display_name" in data[0] else None
+            write_cache(
+                "INSERT OR REPLACE INTO cache_geocodifica (indirizzo, lat, lon, nome) VALUES (?, ?, ?, ?)",
+                (address, lat, lon, full_address),
+                conn
+            )
+            return lat, lon, full_address
         else:
             return None, None, None
     except Exception as e:
-        st.error(f"Errore durante la geocodifica: {e}")
+        notify(f"Errore durante la geocodifica: {e}", avvisi, st.error)
         return None, None, None
 
 # Funzione per ottenere suggerimenti di indirizzi
@@ -69,7 +295,7 @@ def get_address_suggestions(address):
             "User-Agent": "TragittoCalculator/1.0"
         }
         
-        response = requests.get(base_url, params=params, headers=headers)
+        response = requests.get(base_url, params=params, headers=headers, timeout=HTTP_TIMEOUT_SECONDS)
         data = response.json()
         
         suggestions = []
@@ -82,7 +308,13 @@ def get_address_suggestions(address):
         return []
 
 # Funzione per calcolare il percorso tra due punti usando OSRM
-def get_route(start_coords, end_coords):
+def get_route(start_coords, end_coords, conn=None, avvisi=None):
+    # Usa la cache condivisa tra sessioni e worker per non ripetere le richieste a OSRM
+    cache_key = f"{start_coords[0]:.6f},{start_coords[1]:.6f};{end_coords[0]:.6f},{end_coords[1]:.6f}"
+    cached = read_cache("SELECT distanza, durata FROM cache_percorsi WHERE chiave = ?", (cache_key,), conn)
+    if cached is not None:
+        return cached[0], cached[1]
+    
     try:
         base_url = "http://router.project-osrm.org/route/v1/driving/"
         url = f"{base_url}{start_coords[1]},{start_coords[0]};{end_coords[1]},{end_coords[0]}"
@@ -91,76 +323,252 @@ def get_route(start_coords, end_coords):
             "geometries": "geojson"
         }
         
-        response = requests.get(url, params=params)
+        response = requests.get(url, params=params, timeout=HTTP_TIMEOUT_SECONDS)
         data = response.json()
         
         if data["code"] == "Ok":
             route = data["routes"][0]
             distance = route["distance"] / 1000  # Converti in km
             duration = route["duration"] / 60  # Converti in minuti
+            write_cache(
+                "INSERT OR REPLACE INTO cache_percorsi (chiave, distanza, durata) VALUES (?, ?, ?)",
+                (cache_key, distance, duration),
+                conn
+            )
             return distance, duration
         else:
-            st.warning("Non è stato possibile calcolare il percorso")
+            notify("Non è stato possibile calcolare il percorso", avvisi)
             return None, None
     except Exception as e:
-        st.error(f"Errore durante il calcolo del percorso: {e}")
+        notify(f"Errore durante il calcolo del percorso: {e}", avvisi, st.error)
         return None, None
 
 # Funzione per calcolare la matrice delle distanze tra tutti i punti
-def calculate_distance_matrix(coords_list):
+def calculate_distance_matrix(coords_list, conn=None, avvisi=None):
     n = len(coords_list)
     distances = np.zeros((n, n))
     durations = np.zeros((n, n))
     
-    for i in range(n):
-        for j in range(n):
-            if i != j:
-                dist, dur = get_route(coords_list[i], coords_list[j])
-                if dist is not None and dur is not None:
-                    distances[i, j] = dist
-                    durations[i, j] = dur
-                else:
-                    st.warning(f"Impossibile calcolare la distanza tra i punti {i} e {j}")
-                    # Imposta valori predefiniti invece di fermare il calcolo
-                    distances[i, j] = 9999  # Valore alto per evitare questo percorso
-                    durations[i, j] = 9999
+    # Una sola connessione alla cache per tutta la matrice (senza database la cache viene saltata)
+    own_conn = conn is None
+    if own_conn:
+        try:
+            conn = get_db_connection()
+        except sqlite3.Error:
+            own_conn = False
+    
+    try:
+        for i in range(n):
+            for j in range(n):
+                if i != j:
+                    dist, dur = get_route(coords_list[i], coords_list[j], conn, avvisi)
+                    if dist is not None and dur is not None:
+                        distances[i, j] = dist
+                        durations[i, j] = dur
+                    else:
+                        notify(f"Impossibile calcolare la distanza tra i punti {i} e {j}", avvisi)
+                        # Imposta valori predefiniti invece di fermare il calcolo
+                        distances[i, j] = VALORE_NON_DISPONIBILE  # Valore alto per evitare questo percorso
+                        durations[i, j] = VALORE_NON_DISPONIBILE
+    finally:
+        if own_conn:
+            conn.close()
     
     return distances, durations
 
-# Funzione per trovare il percorso ottimale (algoritmo greedy)
-def find_optimal_route(distances, start_index):
-    n = distances.shape[0]
+# Funzione per costruire il percorso casa -> lavori -> casa scegliendo ogni volta la tappa più economica (algoritmo greedy)
+# leg_cost(da, a, costo_accumulato) restituisce il costo della tratta; il percorso torna sempre al punto di partenza
+def find_greedy_route(n, start_index, leg_cost):
     current = start_index
     path = [current]
     remaining = set(range(n))
     remaining.remove(current)
+    costo_accumulato = 0
     
-    # Se abbiamo solo casa e un lavoro
-    if n <= 2:
-        return list(range(n))
-    
-    # Percorso con casa -> lavori -> casa
     while remaining:
-        if len(remaining) == 1 and 0 in remaining:
-            # Se è rimasto solo casa (0), aggiungiamolo
-            next_stop = 0
-        else:
-            # Trova il prossimo posto più vicino (non casa se ci sono ancora altri posti)
-            next_stop = min(
-                [i for i in remaining if (i != 0 or len(remaining) == 1)],
-                key=lambda x: distances[current, x]
-            )
+        # Trova il prossimo posto più economico a partire da quello corrente
+        next_stop = min(remaining, key=lambda x: leg_cost(current, x, costo_accumulato))
+        costo_accumulato += leg_cost(current, next_stop, costo_accumulato)
         
         path.append(next_stop)
         remaining.remove(next_stop)
         current = next_stop
     
-    # Se non torniamo a casa alla fine, aggiungiamo casa
-    if path[-1] != 0:
-        path.append(0)
+    # Torna a casa alla fine (anche se c'è un solo lavoro)
+    if path[-1] != start_index:
+        path.append(start_index)
     
     return path
 
+# Funzione per trovare il percorso ottimale (algoritmo greedy sulle distanze)
+def find_optimal_route(distances, start_index):
+    return find_greedy_route(distances.shape[0], start_index, lambda da, a, _: distances[da, a])
+
+# Funzione per leggere e validare il profilo orario (in cache finché il file non cambia)
+# Restituisce i fattori e l'eventuale errore, senza mostrare nulla nella UI
+@st.cache_data(show_spinner=False)
+def parse_hourly_profile(path, mtime):
+    fattori = np.ones(24)
+    try:
+        profilo = pd.read_csv(path, sep=";")
+        profilo.columns = profilo.columns.str.strip()
+        for ora, fattore in zip(profilo["ORA"], profilo["FATTORE"]):
+            if float(ora) != int(ora) or not 0 <= int(ora) <= 23:
+                raise ValueError(f"ora non valida: {ora} (le ore vanno da 0 a 23)")
+            fattori[int(ora)] = float(fattore)
+        
+        # Fattori mancanti, nulli o negativi renderebbero gli orari di arrivo non validi
+        if not np.all(np.isfinite(fattori)) or not np.all(fattori > 0):
+            raise ValueError("i fattori devono essere numeri positivi")
+    except Exception as e:
+        return np.ones(24), str(e)
+    
+    return fattori, None
+
+# Funzione per caricare il profilo orario dei fattori di durata (fattore 1 per ogni ora se il file manca)
+def load_hourly_profile():
+    if not os.path.exists(PROFILO_ORARIO_PATH):
+        return np.ones(24)
+    
+    mtime = os.path.getmtime(PROFILO_ORARIO_PATH)
+    fattori, errore = parse_hourly_profile(PROFILO_ORARIO_PATH, mtime)
+    
+    # L'avviso viene mostrato una sola volta per sessione e per versione del file
+    if errore is not None and st.session_state.get("profilo_orario_avviso") != mtime:
+        st.session_state.profilo_orario_avviso = mtime
+        st.warning(f"Profilo orario non valido, verranno usate le durate statiche: {errore}")
+    
+    return fattori
+    
+    try:
+        profilo = pd.read_csv(PROFILO_ORARIO_PATH, sep=";")
+        profilo.columns = profilo.columns.str.strip()
+        for ora, fattore in zip(profilo["ORA"], profilo["FATTORE"]):
+            fattori[int(ora) % 24] = float(fattore)
+        
+        # Fattori mancanti, nulli o negativi renderebbero gli orari di arrivo non validi
+        if not np.all(np.isfinite(fattori)) or not np.all(fattori > 0):
+            raise ValueError("i fattori devono essere numeri positivi")
+    except Exception as e:
+        st.warning(f"Profilo orario non valido, verranno usate le durate statiche: {e}")
+        return np.ones(24)
+    
+    return fattori
+
+# Funzione per precalcolare le matrici delle durate per ogni fascia oraria (fasce x punti x punti)
+def build_time_dependent_durations(durations, fattori):
+    return np.asarray(fattori, dtype=float)[:, None, None] * durations[None, :, :]
+
+# Funzione per calcolare gli orari di arrivo (minuti dalla mezzanotte) a ogni tappa di più ordini di visita
+def compute_arrival_times(td_durations, routes, partenza_min):
+    routes = np.asarray(routes, dtype=int)
+    fasce = td_durations.shape[0]
+    minuti_per_fascia = 1440 / fasce
+    
+    arrivals = np.empty(routes.shape)
+    arrivals[:, 0] = partenza_min
+    
+    # Ogni tratta usa la durata della fascia oraria in cui inizia
+    for k in range(routes.shape[1] - 1):
+        fascia = (arrivals[:, k] // minuti_per_fascia).astype(int) % fasce
+        arrivals[:, k + 1] = arrivals[:, k] + td_durations[fascia, routes[:, k], routes[:, k + 1]]
+    
+    return arrivals
+
+# Funzione per trovare il percorso più rapido in base all'orario (algoritmo greedy sulle durate dipendenti dall'ora)
+def find_optimal_route_time_dependent(td_durations, start_index, partenza_min):
+    fasce = td_durations.shape[0]
+    minuti_per_fascia = 1440 / fasce
+    
+    # Ogni tratta usa la durata della fascia oraria in cui inizia (partenza più il tempo già trascorso)
+    def leg_cost(da, a, minuti_trascorsi):
+        fascia = int((partenza_min + minuti_trascorsi) // minuti_per_fascia) % fasce
+        return td_durations[fascia, da, a]
+    
+    return find_greedy_route(td_durations.shape[1], start_index, leg_cost)
+
+# Funzione per convertire un orario (datetime.time) in minuti dalla mezzanotte
+def time_to_minutes(orario):
+    return orario.hour * 60 + orario.minute
+
+# Funzione per valutare in blocco distanza e durata di più ordini di visita (un ordine per riga)
+def evaluate_routes(distances, durations, routes):
+    routes = np.asarray(routes, dtype=int)
+    from_idx = routes[:, :-1]
+    to_idx = routes[:, 1:]
+    return distances[from_idx, to_idx].sum(axis=1), durations[from_idx, to_idx].sum(axis=1)
+
+# Funzione per trovare l'ordine di visita migliore provando tutte le permutazioni dei lavori
+# (il più corto, oppure il più rapido in base all'orario se il criterio è "Tempo")
+def find_best_permutation(distances, td_durations, partenza_min, criterio):
+    n = distances.shape[0]
+    permutations = np.array(list(itertools.permutations(range(1, n))), dtype=int)
+    home = np.zeros((len(permutations), 1), dtype=int)
+    routes = np.hstack([home, permutations, home])
+    if criterio == "Tempo":
+        costs = compute_arrival_times(td_durations, routes, partenza_min)[:, -1]
+    else:
+        costs = distances[routes[:, :-1], routes[:, 1:]].sum(axis=1)
+    return routes[int(np.argmin(costs))].tolist()
+
+# Funzione per mostrare il confronto tra l'ordine ottimizzato, quello del CSV e un ordine manuale
+# Gli ordini vengono rivalutati con l'orario di partenza e il criterio correnti sulle matrici conservate
+def render_route_comparison(comparison, partenza_min, criterio):
+    all_addresses = comparison["addresses"]
+    distances = comparison["distances"]
+    durations = comparison["durations"]
+    td_durations = build_time_dependent_durations(durations, load_hourly_profile())
+    n = len(all_addresses)
+    
+    if criterio == "Tempo":
+        optimal_route = find_optimal_route_time_dependent(td_durations, 0, partenza_min)
+    else:
+        optimal_route = find_optimal_route(distances, 0)
+    
+    st.subheader("Confronto Ordini di Visita")
+    st.caption("Gli ordini vengono valutati sulle distanze già calcolate, senza nuove richieste di geocodifica o di percorso.")
+    
+    candidates = [
+        ("Ottimizzato", optimal_route),
+        ("Ordine del CSV", [0] + list(range(1, n)) + [0])
+    ]
+    
+    if n - 1 <= MAX_LAVORI_PERMUTAZIONI:
+        candidates.append((
+            "Migliore permutazione",
+            find_best_permutation(distances, td_durations, partenza_min, criterio)
+        ))
+    
+    # Ordine manuale: i lavori vengono visitati nell'ordine in cui sono selezionati
+    manual_order = st.multiselect(
+        "Ordine manuale dei lavori",
+        options=list(range(1, n)),
+        default=[idx for idx in optimal_route[1:-1]],
+        format_func=lambda idx: f"{idx}. {all_addresses[idx]}",
+        key=f"manual_order_{comparison['giorno']}"
+    )
+    if len(manual_order) == n - 1:
+        candidates.append(("Manuale", [0] + manual_order + [0]))
+    else:
+        st.info("Seleziona tutti i lavori per valutare l'ordine manuale.")
+    
+    routes = [route for _, route in candidates]
+    total_distances, _ = evaluate_routes(distances, durations, routes)
+    # I tempi tengono conto dell'orario di arrivo a ogni tappa
+    total_durations = compute_arrival_times(td_durations, routes, partenza_min)[:, -1] - partenza_min
+    
+    comparison_data = []
+    for (name, route), total_distance, total_duration in zip(candidates, total_distances, total_durations):
+        comparison_data.append({
+            "Ordine": name,
+            "Sequenza": " → ".join("Casa" if idx == 0 else str(idx) for idx in route),
+            "Distanza Totale (km)": round(float(total_distance), 2),
+            "Tempo Stimato (min)": round(float(total_duration), 0),
+            "Differenza vs Ottimizzato (km)": round(float(total_distance - total_distances[0]), 2)
+        })
+    
+    st.table(pd.DataFrame(comparison_data))
+
 # Funzione per verificare la validità di tutti gli indirizzi
 def validate_addresses(addresses_list):
     invalid_addresses = []
@@ -177,86 +585,281 @@ def validate_addresses(addresses_list):
     
     return invalid_addresses, valid_addresses, valid_coords
 
-# Funzione per calcolare e visualizzare la sommatoria dei km per tutti i giorni
-def calculate_total_km_for_all_days(df):
-    giorni_disponibili = df["GIORNO"].unique().tolist()
+# Funzione per calcolare l'impronta del contenuto di un giorno (cambia solo se cambiano gli indirizzi)
+def compute_day_hash(filtered_df, giorno, parametri):
+    contenuto = [
+        VERSIONE_CALCOLO,
+        parametri,
+        str(giorno),
+        str(filtered_df["CASA"].iloc[0]),
+        [str(addr) for addr in filtered_df["LAVORO"].unique().tolist()]
+    ]
+    return hashlib.sha256(json.dumps(contenuto).encode("utf-8")).hexdigest()
+
+# Funzione per calcolare il percorso ottimale di un singolo giorno
+def calculate_day_total(filtered_df, giorno, fattori, partenza_min, criterio, conn=None, avvisi=None):
+    problematic_addresses = []
+    
+    # Ottieni tutti gli indirizzi unici per quel giorno
+    casa_address = filtered_df["CASA"].iloc[0]
+    lavoro_addresses = filtered_df["LAVORO"].unique().tolist()
+    
+    # Geocodifica tutti gli indirizzi
+    coords_casa = geocode_address(casa_address, conn, avvisi)
+    if coords_casa[0] is None:
+        problematic_addresses.append(("casa", casa_address, giorno))
+        return None, problematic_addresses
+    
+    coords_lavoro_list = []
+    for addr in lavoro_addresses:
+        coords = geocode_address(addr, conn, avvisi)
+        if coords[0] is None:
+            problematic_addresses.append(("lavoro", addr, giorno))
+        else:
+            coords_lavoro_list.append((coords[0], coords[1]))
+    
+    if problematic_addresses:
+        return None, problematic_addresses
+    
+    # Crea lista completa di coordinate con casa come prima posizione
+    all_coords = [(coords_casa[0], coords_casa[1])] + coords_lavoro_list
+    
+    # Calcola la matrice delle distanze
+    distances, durations = calculate_distance_matrix(all_coords, conn, avvisi)
+    
+    # Un giorno con tratte non calcolate darebbe totali fittizi: viene saltato (e quindi non salvato né riusato)
+    if (distances >= VALORE_NON_DISPONIBILE).any():
+        notify(f"Impossibile calcolare la matrice delle distanze per il giorno {giorno}. Verrà saltato.", avvisi)
+        return None, problematic_addresses
+    
+    # Trova il percorso ottimale secondo il criterio scelto
+    td_durations = build_time_dependent_durations(durations, fattori)
+    if criterio == "Tempo":
+        optimal_route = find_optimal_route_time_dependent(td_durations, 0, partenza_min)
+    else:
+        optimal_route = find_optimal_route(distances, 0)
+    
+    # Calcola la distanza totale
+    total_distance = 0
+    
+    for i in range(len(optimal_route) - 1):
+        from_idx = optimal_route[i]
+        to_idx = optimal_route[i + 1]
+        total_distance += distances[from_idx, to_idx]
+    
+    # Calcola la durata in base all'orario di arrivo a ogni tappa
+    total_duration = compute_arrival_times(td_durations, [optimal_route], partenza_min)[0, -1] - partenza_min
+    
+    return {
+        "Giorno": giorno,
+        "Numero Lavori": len(lavoro_addresses),
+        "Distanza Totale (km)": round(float(total_distance), 2),
+        "Tempo Stimato (min)": round(float(total_duration), 0)
+    }, problematic_addresses
+
+# Funzione eseguita dai worker: calcola i giorni mancanti di un job salvando un checkpoint per ogni giorno
+def run_job(job_id):
+    load_heavy_modules()
+    conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT dati, parametri FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return
+        
+        parametri = json.loads(row[1])
+        fattori = np.array(parametri["fattori"])
+        partenza_min = parametri["partenza_min"]
+        criterio = parametri.get("criterio", "Distanza")
+        
+        with conn:
+            conn.execute("UPDATE jobs SET stato = 'in_corso', aggiornato = ? WHERE id = ?", (time.time(), job_id))
+        
+        df = pd.read_csv(io.StringIO(row[0]), sep=";")
+        
+        # I giorni già salvati (ad esempio prima di un crash) non vengono ricalcolati
+        completati = {r[0] for r in conn.execute("SELECT posizione FROM job_giorni WHERE job_id = ?", (job_id,))}
+        
+        # groupby salta le righe senza GIORNO (ad esempio righe vuote), che darebbero gruppi vuoti
+        for posizione, (giorno, filtered_df) in enumerate(df.groupby("GIORNO", sort=False)):
+            if posizione in completati:
+                continue
+            
+            day_hash = compute_day_hash(filtered_df, giorno, row[1])
+            
+            # Riusa il risultato salvato se il giorno non è cambiato rispetto a un caricamento precedente
+            stored = conn.execute("SELECT risultato FROM risultati_giorni WHERE hash = ?", (day_hash,)).fetchone()
+            # Gli avvisi vengono salvati con il giorno: i worker non possono mostrarli con Streamlit
+            avvisi = []
+            if stored is not None:
+                risultato_json, problemi, riutilizzato = stored[0], [], 1
+            else:
+                risultato, problemi = calculate_day_total(filtered_df, giorno, fattori, partenza_min, criterio, conn, avvisi)
+                risultato_json = json.dumps(risultato, default=str) if risultato is not None else None
+                riutilizzato = 0
+            
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO job_giorni (job_id, posizione, giorno, risultato, problemi, riutilizzato, avvisi) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, posizione, str(giorno), risultato_json, json.dumps(problemi, default=str), riutilizzato, json.dumps(avvisi))
+                )
+                # Salva solo i giorni calcolati senza indirizzi problematici
+                if not riutilizzato and risultato_json is not None and not problemi:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO risultati_giorni (hash, risultato, aggiornato) VALUES (?, ?, ?)",
+                        (day_hash, risultato_json, time.time())
+                    )
+                conn.execute("UPDATE jobs SET aggiornato = ? WHERE id = ?", (time.time(), job_id))
+        
+        with conn:
+            conn.execute("UPDATE jobs SET stato = 'completato', aggiornato = ? WHERE id = ?", (time.time(), job_id))
+    except Exception as e:
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET stato = 'errore', errore = ?, aggiornato = ? WHERE id = ?",
+                (str(e), time.time(), job_id)
+            )
+    finally:
+        conn.close()
+
+# Pool di worker condiviso tra tutte le sessioni (creato una sola volta per processo)
+@st.cache_resource
+def get_job_executor():
+    executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="tragitto-job")
+    
+    # Riprendi i job interrotti da un crash o da un riavvio dell'applicazione
+    conn = get_db_connection()
+    try:
+        pending_jobs = [r[0] for r in conn.execute("SELECT id FROM jobs WHERE stato IN ('in_coda', 'in_corso') ORDER BY id")]
+    finally:
+        conn.close()
+    
+    for job_id in pending_jobs:
+        executor.submit(run_job, job_id)
+    
+    return executor
+
+# Funzione per preparare i dati di un job e l'impronta che identifica lo stesso CSV con gli stessi parametri
+def build_job_payload(df, fattori, partenza_min, criterio):
+    dati = df[["CASA", "LAVORO", "GIORNO"]].to_csv(sep=";", index=False)
+    parametri = json.dumps({"partenza_min": partenza_min, "fattori": [float(f) for f in fattori], "criterio": criterio})
+    csv_hash = hashlib.sha256((dati + parametri).encode("utf-8")).hexdigest()
+    return dati, parametri, csv_hash
+
+# Funzione per trovare l'ultimo job dello stesso CSV con gli stessi parametri (anche se avviato da un'altra sessione)
+def find_latest_job(df, fattori, partenza_min, criterio):
+    _, _, csv_hash = build_job_payload(df, fattori, partenza_min, criterio)
+    conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT id FROM jobs WHERE csv_hash = ? ORDER BY id DESC LIMIT 1", (csv_hash,)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row is not None else None
+
+# Funzione per accodare il calcolo di tutti i giorni (lo stesso CSV con gli stessi parametri riusa il job ancora in esecuzione)
+def submit_total_km_job(df, fattori, partenza_min, criterio):
+    dati, parametri, csv_hash = build_job_payload(df, fattori, partenza_min, criterio)
+    executor = get_job_executor()
+    
+    conn = get_db_connection()
+    try:
+        now = time.time()
+        
+        # Controllo e inserimento nella stessa transazione: due sessioni che inviano insieme lo stesso CSV
+        # non possono creare due job e ripetere le stesse richieste alle API
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Un job in corso che non avanza da troppo tempo (ad esempio un worker bloccato) viene chiuso come errore
+            conn.execute(
+                "UPDATE jobs SET stato = 'errore', errore = ?, aggiornato = ? WHERE csv_hash = ? AND stato = 'in_corso' AND aggiornato < ?",
+                ("Nessun avanzamento: job interrotto", now, csv_hash, now - JOB_STALE_SECONDS)
+            )
+            
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE csv_hash = ? AND stato IN ('in_coda', 'in_corso') ORDER BY id DESC LIMIT 1",
+                (csv_hash,)
+            ).fetchone()
+            if row is not None:
+                conn.commit()
+                return row[0]
+            
+            # Un job concluso non viene riusato: il nuovo job riprende da risultati_giorni i giorni già calcolati
+            # e ricalcola solo quelli falliti o modificati
+            cursor = conn.execute(
+                "INSERT INTO jobs (csv_hash, dati, parametri, stato, giorni_totali, creato, aggiornato) VALUES (?, ?, ?, 'in_coda', ?, ?, ?)",
+                (csv_hash, dati, parametri, df.groupby("GIORNO", sort=False).ngroups, now, now)
+            )
+            job_id = cursor.lastrowid
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        conn.close()
+    
+    executor.submit(run_job, job_id)
+    return job_id
+
+# Funzione per leggere lo stato di avanzamento di un job
+def get_job_status(job_id):
+    conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT stato, giorni_totali, errore FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        giorni_completati, giorni_riutilizzati = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(riutilizzato), 0) FROM job_giorni WHERE job_id = ?",
+            (job_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+    
+    return {
+        "stato": row[0],
+        "giorni_totali": row[1],
+        "giorni_completati": giorni_completati,
+        "giorni_riutilizzati": giorni_riutilizzati,
+        "errore": row[2]
+    }
+
+# Funzione per raccogliere i risultati salvati di un job e la sommatoria dei km per tutti i giorni
+def get_job_results(job_id):
     risultati_totali = []
     distanza_totale_complessiva = 0
     durata_totale_complessiva = 0
-    
-    # Raccogliamo tutti gli indirizzi problematici
     problematic_addresses = []
-
-    with st.spinner("Calcolo dei percorsi per tutti i giorni..."):
-        for giorno in giorni_disponibili:
-            # Filtra per il giorno corrente
-            filtered_df = df[df["GIORNO"] == giorno]
-            
-            if not filtered_df.empty:
-                # Ottieni tutti gli indirizzi unici per quel giorno
-                casa_address = filtered_df["CASA"].iloc[0]
-                lavoro_addresses = filtered_df["LAVORO"].unique().tolist()
-                
-                # Geocodifica tutti gli indirizzi
-                coords_casa = geocode_address(casa_address)
-                if coords_casa[0] is None:
-                    problematic_addresses.append(("casa", casa_address, giorno))
-                    continue
-                
-                coords_lavoro_list = []
-                geocode_failed = False
-                for addr in lavoro_addresses:
-                    coords = geocode_address(addr)
-                    if coords[0] is None:
-                        problematic_addresses.append(("lavoro", addr, giorno))
-                        geocode_failed = True
-                    else:
-                        coords_lavoro_list.append((coords[0], coords[1]))
-                
-                if geocode_failed:
-                    continue
-                
-                # Crea lista completa di coordinate con casa come prima posizione
-                all_coords = [(coords_casa[0], coords_casa[1])] + coords_lavoro_list
-                
-                # Calcola la matrice delle distanze
-                distances, durations = calculate_distance_matrix(all_coords)
-                
-                if distances is None or durations is None:
-                    st.warning(f"Impossibile calcolare la matrice delle distanze per il giorno {giorno}. Verrà saltato.")
-                    continue
-                
-                # Trova il percorso ottimale
-                optimal_route = find_optimal_route(distances, 0)
-                
-                # Calcola la distanza totale e la durata
-                total_distance = 0
-                total_duration = 0
-                
-                for i in range(len(optimal_route) - 1):
-                    from_idx = optimal_route[i]
-                    to_idx = optimal_route[i + 1]
-                    total_distance += distances[from_idx, to_idx]
-                    total_duration += durations[from_idx, to_idx]
-                
-                # Aggiungi ai totali complessivi
-                distanza_totale_complessiva += total_distance
-                durata_totale_complessiva += total_duration
-                
-                # Salva risultati per questo giorno
-                risultati_totali.append({
-                    "Giorno": giorno,
-                    "Numero Lavori": len(lavoro_addresses),
-                    "Distanza Totale (km)": round(total_distance, 2),
-                    "Tempo Stimato (min)": round(total_duration, 0)
-                })
+    avvisi = []
+    
+    conn = get_db_connection()
+    try:
+        rows = conn.execute(
+            "SELECT giorno, risultato, problemi, avvisi FROM job_giorni WHERE job_id = ? ORDER BY posizione",
+            (job_id,)
+        ).fetchall()
+    finally:
+        conn.close()
     
-    return risultati_totali, round(distanza_totale_complessiva, 2), round(durata_totale_complessiva, 0), problematic_addresses
+    for giorno, risultato, problemi, avvisi_giorno in rows:
+        problematic_addresses.extend(tuple(p) for p in json.loads(problemi))
+        avvisi.extend(f"Giorno {giorno}: {avviso}" for avviso in json.loads(avvisi_giorno))
+        if risultato is not None:
+            risultato = json.loads(risultato)
+            distanza_totale_complessiva += risultato["Distanza Totale (km)"]
+            durata_totale_complessiva += risultato["Tempo Stimato (min)"]
+            risultati_totali.append(risultato)
+    
+    return risultati_totali, round(distanza_totale_complessiva, 2), round(durata_totale_complessiva, 0), problematic_addresses, avvisi
+
+# Prepara il database e avvia subito il pool di worker, così i job interrotti da un riavvio riprendono senza attendere un nuovo invio
+# Senza un database scrivibile l'applicazione funziona comunque, senza cache e senza calcoli in background
+db_path = init_db()
+if db_path is not None:
+    get_job_executor()
 
 # Sezione per il caricamento del file
 uploaded_file = st.file_uploader("Carica il tuo file CSV", type=["csv"])
 
 if uploaded_file:
+    load_heavy_modules()
     df = load_csv(uploaded_file)
     
     if df is not None:
@@ -266,10 +869,19 @@ if uploaded_file:
         st.subheader("Anteprima dei dati")
         st.dataframe(df.head())
         
-        # Aggiungi tab per separare le funzionalità
-        tab1, tab2, tab3 = st.tabs(["Calcolo Giornaliero", "Riepilogo Totale", "Verifica Indirizzi"])
+        # Selettore delle sezioni: viene costruita solo la sezione attiva, non tutte ad ogni rerun
+        sezioni = ["Calcolo Giornaliero", "Riepilogo Totale", "Verifica Indirizzi"]
+        sezione_salvata = st.session_state.get("active_tab")
+        sezione_attiva = st.radio(
+            "Sezione",
+            sezioni,
+            index=sezioni.index(sezione_salvata) if sezione_salvata in sezioni else 0,
+            horizontal=True,
+            label_visibility="collapsed"
+        )
+        st.session_state.active_tab = sezione_attiva
         
-        with tab1:
+        if sezione_attiva == "Calcolo Giornaliero":
             # Processo di aggiunta degli indirizzi se necessario
             if df.empty or (len(df) == 1 and df.iloc[0].isna().all()):
                 st.info("Il file CSV è vuoto. Aggiungi i tuoi indirizzi.")
@@ -294,6 +906,16 @@ if uploaded_file:
                 if giorni_disponibili:
                     giorno_selezionato = st.selectbox("Seleziona un giorno", giorni_disponibili)
                     
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        orario_partenza = st.time_input(
+                            "Orario di partenza da casa",
+                            datetime.strptime(ORARIO_PARTENZA_DEFAULT, "%H:%M").time(),
+                            key="partenza_giornaliera"
+                        )
+                    with col2:
+                        criterio_ottimizzazione = st.radio("Ottimizza per", ["Distanza", "Tempo"], horizontal=True)
+                    
                     if st.button("Calcola Tragitto Ottimale"):
                         # Filtra per il giorno selezionato
                         filtered_df = df[df["GIORNO"] == giorno_selezionato]
@@ -376,7 +998,7 @@ if uploaded_file:
     
     # Procedi con il calcolo
     st.success("Indirizzi corretti applicati. Calcolo del tragitto...")
-    st.experimental_rerun()
+    restart_run()
                             
                             else:
                                 # Tutti gli indirizzi sono validi, procedi con il calcolo
@@ -394,22 +1016,40 @@ if uploaded_file:
                                     
                                     if distances is None or durations is None:
                                         st.error("Impossibile calcolare la matrice delle distanze.")
-                                        st.stop()
+                                        stop_run()
                                 
                                 # Trova il percorso ottimale
                                 with st.spinner("Calcolo del percorso ottimale..."):
+                                    # Precalcola le durate per ogni fascia oraria del profilo
+                                    partenza_min = time_to_minutes(orario_partenza)
+                                    td_durations = build_time_dependent_durations(durations, load_hourly_profile())
+                                    
                                     # Casa è sempre indice 0
-                                    optimal_route = find_optimal_route(distances, 0)
+                                    if criterio_ottimizzazione == "Tempo":
+                                        optimal_route = find_optimal_route_time_dependent(td_durations, 0, partenza_min)
+                                    else:
+                                        optimal_route = find_optimal_route(distances, 0)
                                     
-                                    # Calcola la distanza totale e la durata
+                                    # Calcola la distanza totale
                                     total_distance = 0
-                                    total_duration = 0
                                     
                                     for i in range(len(optimal_route) - 1):
                                         from_idx = optimal_route[i]
                                         to_idx = optimal_route[i + 1]
                                         total_distance += distances[from_idx, to_idx]
-                                        total_duration += durations[from_idx, to_idx]
+                                    
+                                    # Calcola gli orari di arrivo e la durata in base all'ora di ogni tratta
+                                    arrival_times = compute_arrival_times(td_durations, [optimal_route], partenza_min)[0]
+                                    total_duration = arrival_times[-1] - partenza_min
+                                
+                                # Conserva le matrici del giorno per il confronto degli ordini di visita senza ricalcolare
+                                st.session_state.route_comparison = {
+                                    "giorno": giorno_selezionato,
+                                    "day_hash": compute_day_hash(filtered_df, giorno_selezionato, ""),
+                                    "addresses": all_addresses,
+                                    "distances": distances,
+                                    "durations": durations
+                                }
                                 
                                 # Mostra i risultati
                                 st.subheader("Percorso Ottimale")
@@ -431,7 +1071,8 @@ if uploaded_file:
                                         "Tappa": i + 1,
                                         "Tipo": address_type,
                                         "Indirizzo": address,
-                                        "Distanza dalla tappa precedente (km)": f"{distance_from_prev:.2f}" if distance_from_prev is not None else "-"
+                                        "Distanza dalla tappa precedente (km)": f"{distance_from_prev:.2f}" if distance_from_prev is not None else "-",
+                                        "Orario previsto": f"{int(arrival_times[i] // 60) % 24:02d}:{int(arrival_times[i] % 60):02d}"
                                     })
                                 
                                 route_df = pd.DataFrame(route_data)
@@ -498,15 +1139,75 @@ if uploaded_file:
                                         st.markdown(f"[{from_address} → {to_address}]({segment_url})")
                         else:
                             st.warning(f"Nessun dato trovato per il giorno {giorno_selezionato}.")
+                    
+                    # Confronto tra ordini di visita alternativi usando le matrici già calcolate
+                    # (solo se gli indirizzi del giorno non sono cambiati dopo il calcolo;
+                    # orario di partenza e criterio sono sempre quelli mostrati nei widget)
+                    comparison = st.session_state.get("route_comparison")
+                    if (
+                        comparison is not None
+                        and comparison["giorno"] == giorno_selezionato
+                        and comparison["day_hash"] == compute_day_hash(df[df["GIORNO"] == giorno_selezionato], giorno_selezionato, "")
+                        and len(comparison["addresses"]) > 2
+                    ):
+                        render_route_comparison(comparison, time_to_minutes(orario_partenza), criterio_ottimizzazione)
                 else:
                     st.warning("Nessun giorno trovato nel file CSV.")
         
-        with tab2:
+        elif sezione_attiva == "Riepilogo Totale" and db_path is None:
+            st.warning("Il calcolo per tutti i giorni non è disponibile: impossibile creare il database dei job.")
+        
+        elif sezione_attiva == "Riepilogo Totale":
             st.subheader("Calcolo Sommatoria Chilometri per Tutti i Giorni")
             
             if not df.empty:
+                col1, col2 = st.columns(2)
+                with col1:
+                    orario_partenza = st.time_input(
+                        "Orario di partenza da casa",
+                        datetime.strptime(ORARIO_PARTENZA_DEFAULT, "%H:%M").time(),
+                        key="partenza_totale"
+                    )
+                with col2:
+                    criterio_ottimizzazione = st.radio("Ottimizza per", ["Distanza", "Tempo"], horizontal=True, key="criterio_totale")
+                
+                fattori = load_hourly_profile()
+                partenza_min = time_to_minutes(orario_partenza)
+                
                 if st.button("Calcola Totale per Tutti i Giorni"):
-                    risultati_totali, distanza_totale_complessiva, durata_totale_complessiva, problematic_addresses = calculate_total_km_for_all_days(df)
+                    # Il calcolo viene accodato ai worker in background e sopravvive alla chiusura della pagina
+                    submit_total_km_job(df, fattori, partenza_min, criterio_ottimizzazione)
+                
+                # L'ultimo job per questo file viene ritrovato anche da una nuova sessione, senza premere il pulsante
+                job_id = find_latest_job(df, fattori, partenza_min, criterio_ottimizzazione)
+                job_status = get_job_status(job_id) if job_id is not None else None
+                
+                if job_status is not None and job_status["stato"] in ("in_coda", "in_corso"):
+                    giorni_totali = max(job_status["giorni_totali"], 1)
+                    st.progress(
+                        job_status["giorni_completati"] / giorni_totali,
+                        text=f"Giorni calcolati: {job_status['giorni_completati']} di {job_status['giorni_totali']}"
+                    )
+                    st.info("Il calcolo prosegue in background: puoi chiudere la pagina e ricaricare lo stesso file più tardi.")
+                    st.caption(f"Giorni ricalcolati: {job_status['giorni_completati'] - job_status['giorni_riutilizzati']} · Giorni riutilizzati: {job_status['giorni_riutilizzati']}")
+                    # L'aggiornamento dell'avanzamento avviene alla fine dello script
+                    st.session_state.job_polling = True
+                
+                elif job_status is not None and job_status["stato"] == "errore":
+                    st.error(f"Errore durante il calcolo in background: {job_status['errore']}")
+                
+                elif job_status is not None:
+                    risultati_totali, distanza_totale_complessiva, durata_totale_complessiva, problematic_addresses, avvisi = get_job_results(job_id)
+                    
+                    # Mostra quanti giorni sono stati ricalcolati e quanti riutilizzati da caricamenti precedenti
+                    giorni_riutilizzati = job_status["giorni_riutilizzati"]
+                    st.info(f"Giorni ricalcolati: {job_status['giorni_completati'] - giorni_riutilizzati} · Giorni riutilizzati: {giorni_riutilizzati}")
+                    
+                    # Mostra gli avvisi raccolti dai worker durante il calcolo
+                    if avvisi:
+                        with st.expander(f"Avvisi durante il calcolo ({len(avvisi)})"):
+                            for avviso in avvisi:
+                                st.warning(avviso)
                     
                     # Se ci sono indirizzi problematici, mostra un avviso e passa alla tab di correzione
                     if problematic_addresses:
@@ -518,7 +1219,7 @@ if uploaded_file:
                         # Mostra link alla tab di correzione
                         if st.button("Vai alla tab Verifica Indirizzi"):
                             st.session_state.active_tab = "Verifica Indirizzi"
-                            st.experimental_rerun()
+                            restart_run()
                     
                     if risultati_totali:
                         # Visualizza tabella con i risultati per ogni giorno
@@ -544,7 +1245,7 @@ if uploaded_file:
             else:
                 st.info("Carica un file CSV con dati validi per calcolare la sommatoria dei chilometri.")
         
-        with tab3:
+        elif sezione_attiva == "Verifica Indirizzi":
             st.subheader("Verifica e Correzione Indirizzi")
             
             if st.button("Verifica tutti gli indirizzi"):
@@ -674,7 +1375,7 @@ if uploaded_file:
                     # Rimuovi duplicati
                     invalid_addresses = list(set(invalid_addresses))
                     st.session_state.invalid_addresses = invalid_addresses
-                    st.experimental_rerun()
+                    restart_run()
             else:
                 st.info("Clicca su 'Verifica tutti gli indirizzi' per iniziare il processo di verifica.")
 
@@ -683,6 +1384,8 @@ else:
     
     # Aggiungi opzione per creare un nuovo file
     if st.button("Crea nuovo file"):
+        load_heavy_modules()
+        
         # Crea un DataFrame vuoto con le colonne necessarie
         df = pd.DataFrame(columns=["CASA", "LAVORO", "GIORNO"])
         
@@ -714,15 +1417,15 @@ else:
                 st.success("File creato con successo!")
                 st.dataframe(df)
 
-# Aggiungi istruzioni d'uso
-with st.expander("Come usare questa applicazione"):
+# Aggiungi istruzioni d'uso (costruite solo su richiesta)
+if st.checkbox("Mostra le istruzioni d'uso"):
     st.markdown("""
     ### Istruzioni per l'uso
     
     1. **Carica il tuo file CSV** con le colonne CASA, LAVORO e GIORNO.
     2. **Seleziona un giorno** dalla lista dei giorni disponibili oppure usa la tab "Riepilogo Totale" per calcolare i km totali per tutti i giorni.
     3. **Premi 'Calcola Tragitto Ottimale'** per vedere il percorso ottimale che inizia da casa, passa per tutti i luoghi di lavoro e torna a casa.
-    4. **Premi 'Calcola Totale per Tutti i Giorni'** nella tab "Riepilogo Totale" per vedere la sommatoria dei chilometri per tutti i giorni.
+    4. **Premi 'Calcola Totale per Tutti i Giorni'** nella tab "Riepilogo Totale" per vedere la sommatoria dei chilometri per tutti i giorni. Il calcolo prosegue in background: puoi chiudere la pagina e ricaricare lo stesso file per ritrovarne l'avanzamento.
     5. **Usa la tab 'Verifica Indirizzi'** per controllare e correggere eventuali indirizzi problematici.
     
     ### Formato del file CSV
@@ -740,6 +1443,12 @@ with st.expander("Come usare questa applicazione"):
     Via Roma 1, Milano;Piazza Duomo 1, Milano;01/05/2025
     ```
     
+    ### Tempi in base all'orario
+    
+    I tempi stimati partono dall'orario di partenza scelto e tengono conto dell'ora di ogni tratta.
+    Il file `profilo_orario.csv` (colonne ORA e FATTORE) indica per ogni ora di quanto moltiplicare la durata calcolata da OSRM.
+    Se il file non è presente vengono usate le durate di OSRM senza correzioni.
+    
     ### Note sulla correzione degli indirizzi
     
     - Se un indirizzo non viene trovato, l'applicazione ti permetterà di correggerlo.
@@ -751,3 +1460,17 @@ with st.expander("Come usare questa applicazione"):
 # Footer con informazioni
 st.markdown("---")
 st.markdown("Applicazione creata con Streamlit. Utilizza le API gratuite di OpenStreetMap e OSRM.")
+
+# Misura la durata di questo run (l'attesa per l'aggiornamento dei job è esclusa)
+startup_metrics = finish_run()
+if startup_metrics["primo_run_processo_ms"] is not None:
+    st.caption(
+        f"Primo run dello script: {startup_metrics['primo_run_processo_ms']:.0f} ms · "
+        f"Ultimo run: {startup_metrics['ultimo_run_ms']:.0f} ms"
+    )
+
+# Aggiorna periodicamente la pagina mentre un job in background è in esecuzione
+if st.session_state.pop("job_polling", False):
+    time.sleep(JOB_POLL_SECONDS)
+    st.session_state.rerun_da_polling = True
+    st.experimental_rerun()